@@ -1,10 +1,16 @@
-from typing import Any, Dict, Optional
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+_MISSING = object()
 
 
 class MemoryManager:
     """
     Very small in-memory store used as a placeholder for
     agent memory. Not persistent — just a process-local dict.
+
+    Every operation is a single dict call, so each one is atomic under the GIL;
+    callers that combine several calls (read-then-write) need their own locking.
     """
 
     def __init__(self) -> None:
@@ -20,7 +26,7 @@ class MemoryManager:
 
     def delete(self, key: str) -> bool:
         """Delete a key. Returns True if deleted, False if not present."""
-        return self._store.pop(key, None) is not None
+        return self._store.pop(key, _MISSING) is not _MISSING
 
     def clear(self) -> None:
         """Clear all stored memory."""
@@ -28,4 +34,67 @@ class MemoryManager:
 
     def keys(self):
         """Return list of keys currently stored."""
-        return list(self._store.keys())
\ No newline at end of file
+        return list(self._store.keys())
+
+
+class ShardedMemoryManager:
+    """
+    Same interface as MemoryManager, but the store is split into shards that
+    each have their own lock, so concurrent writers touching different keys
+    don't contend. Single-key operations lock only the key's shard;
+    `keys()` and `clear()` briefly acquire every shard.
+    """
+
+    SHARD_COUNT = 64  # must be a power of two
+
+    def __init__(self) -> None:
+        self._shards: List[Tuple[Dict[str, Any], threading.Lock]] = [
+            ({}, threading.Lock()) for _ in range(self.SHARD_COUNT)
+        ]
+
+    def _shard(self, key: str) -> Tuple[Dict[str, Any], threading.Lock]:
+        return self._shards[hash(key) & (self.SHARD_COUNT - 1)]
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a value under `key`."""
+        store, lock = self._shard(key)
+        with lock:
+            store[key] = value
+
+    def get(self, key: str, default: Optional[Any] = None) -> Any:
+        """Retrieve a stored value or default if missing."""
+        store, lock = self._shard(key)
+        with lock:
+            return store.get(key, default)
+
+    def delete(self, key: str) -> bool:
+        """Delete a key. Returns True if deleted, False if not present."""
+        store, lock = self._shard(key)
+        with lock:
+            return store.pop(key, _MISSING) is not _MISSING
+
+    def clear(self) -> None:
+        """Clear all stored memory."""
+        self._lock_all()
+        try:
+            for store, _ in self._shards:
+                store.clear()
+        finally:
+            self._unlock_all()
+
+    def keys(self):
+        """Return list of keys currently stored (consistent snapshot across shards)."""
+        self._lock_all()
+        try:
+            return [key for store, _ in self._shards for key in store]
+        finally:
+            self._unlock_all()
+
+    def _lock_all(self) -> None:
+        # Always acquire in shard order so concurrent keys()/clear() can't deadlock.
+        for _, lock in self._shards:
+            lock.acquire()
+
+    def _unlock_all(self) -> None:
+        for _, lock in reversed(self._shards):
+            lock.release()
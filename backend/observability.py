@@ -1,24 +1,61 @@
-from typing import Dict
-from threading import Lock
+import os
+import threading
+from array import array
+from typing import List
 
 # Simple in-process counters. This is intentionally tiny — suitable for local/dev relay mocks.
 # For production you'd integrate with Prometheus, StatsD, or similar.
+#
+# By default the counters are plain list slots: the relay is a single-threaded asyncio
+# server (every handler is `async def`) and each uvicorn worker is its own process with
+# its own counters, so nothing else can race an increment. If you increment from several
+# threads inside one worker (sync handlers, thread pools), opt in with
+# RELAY_METRICS_THREADSAFE=1; each thread then gets its own shard and reads sum them.
 
-_metrics_lock = Lock()
-_metrics: Dict[str, int] = {
-    "api_calls_total": 0,
-    "ws_connections_total": 0,
-}
+_THREADSAFE = os.getenv("RELAY_METRICS_THREADSAFE", "0") == "1"
 
+_API_CALLS = 0
+_WS_CONNECTIONS = 1
 
-def increment_api_calls(amount: int = 1) -> None:
-    with _metrics_lock:
-        _metrics["api_calls_total"] += int(amount)
+if _THREADSAFE:
+    # 8 x uint64 = 64 bytes, i.e. one cache line per shard.
+    _SHARD_SLOTS = 8
 
+    _shards: List[array] = []
+    _shards_lock = threading.Lock()  # only taken when a thread creates its shard, and on scrape
+    _local = threading.local()
 
-def increment_ws_connections(amount: int = 1) -> None:
-    with _metrics_lock:
-        _metrics["ws_connections_total"] += int(amount)
+    def _shard() -> array:
+        try:
+            return _local.shard
+        except AttributeError:
+            shard = array("Q", [0]) * _SHARD_SLOTS
+            with _shards_lock:
+                _shards.append(shard)
+            _local.shard = shard
+            return shard
+
+    def _total(slot: int) -> int:
+        with _shards_lock:
+            return sum(shard[slot] for shard in _shards)
+
+    def increment_api_calls(amount: int = 1) -> None:
+        _shard()[_API_CALLS] += int(amount)
+
+    def increment_ws_connections(amount: int = 1) -> None:
+        _shard()[_WS_CONNECTIONS] += int(amount)
+
+else:
+    _counts: List[int] = [0, 0]
+
+    def _total(slot: int) -> int:
+        return _counts[slot]
+
+    def increment_api_calls(amount: int = 1) -> None:
+        _counts[_API_CALLS] += int(amount)
+
+    def increment_ws_connections(amount: int = 1) -> None:
+        _counts[_WS_CONNECTIONS] += int(amount)
 
 
 def get_metrics_text() -> str:
@@ -26,15 +63,14 @@ def get_metrics_text() -> str:
     Return metrics in a simple Prometheus exposition format (text/plain).
     Consumers (like Prometheus) can scrape this endpoint.
     """
-    with _metrics_lock:
-        lines = [
-            "# HELP relay_api_calls_total Number of /api/execute_method calls received",
-            "# TYPE relay_api_calls_total counter",
-            f"relay_api_calls_total {_metrics['api_calls_total']}",
-            "",
-            "# HELP relay_ws_connections_total Number of WebSocket connections accepted",
-            "# TYPE relay_ws_connections_total counter",
-            f"relay_ws_connections_total {_metrics['ws_connections_total']}",
-            "",
-        ]
-    return "\n".join(lines)
\ No newline at end of file
+    lines = [
+        "# HELP relay_api_calls_total Number of /api/execute_method calls received",
+        "# TYPE relay_api_calls_total counter",
+        f"relay_api_calls_total {_total(_API_CALLS)}",
+        "",
+        "# HELP relay_ws_connections_total Number of WebSocket connections accepted",
+        "# TYPE relay_ws_connections_total counter",
+        f"relay_ws_connections_total {_total(_WS_CONNECTIONS)}",
+        "",
+    ]
+    return "\n".join(lines)
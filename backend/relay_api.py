@@ -4,18 +4,37 @@ Relay helper stubs and small utilities.
 This module purposefully provides a couple of small helpers that higher-level
 relay code or unit tests can import. Keep it minimal and safe for the mock relay.
 """
-from typing import Any, Dict, Optional
-from .memory_manager import MemoryManager
+import os
+import threading
+from typing import Any, Dict, Optional, Union
+from .memory_manager import MemoryManager, ShardedMemoryManager
+
+AnyMemoryManager = Union[MemoryManager, ShardedMemoryManager]
 
 # Simple shared memory manager instance for in-process use.
-_shared_memory: Optional[MemoryManager] = None
+_shared_memory: Optional[AnyMemoryManager] = None
+_init_lock = threading.Lock()
 
 
-def get_memory_manager() -> MemoryManager:
+def get_memory_manager() -> AnyMemoryManager:
+    """
+    Return the process-wide memory manager. Set RELAY_MEMORY_SHARDED=1 to use the
+    lock-striped ShardedMemoryManager for write-heavy, multi-threaded use.
+    """
     global _shared_memory
-    if _shared_memory is None:
-        _shared_memory = MemoryManager()
-    return _shared_memory
+    # Double-checked locking: the common (already initialised) path takes no lock,
+    # while first-time creation is serialised so concurrent callers share one instance.
+    mm = _shared_memory
+    if mm is None:
+        with _init_lock:
+            mm = _shared_memory
+            if mm is None:
+                if os.getenv("RELAY_MEMORY_SHARDED", "0") == "1":
+                    mm = ShardedMemoryManager()
+                else:
+                    mm = MemoryManager()
+                _shared_memory = mm
+    return mm
 
 
 def store_agent_state(agent_id: str, data: Dict[str, Any]) -> None:
@@ -2,16 +2,18 @@ import os
 import json
 import asyncio
 import logging
-from typing import Any, Dict, List, Optional
-from urllib.parse import urlparse, urlunparse, urlencode
+from itertools import chain
+from typing import Any, Dict, FrozenSet, List, Optional
+from urllib.parse import quote_plus, urlparse
 
 import httpx
 import websockets
 
 from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse, JSONResponse, Response
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 
 # Local helpers (in-repo)
 from backend import observability as observability  # simple metrics helpers
@@ -33,23 +35,26 @@ FRONTEND_ORIGIN = os.getenv(
     "http://localhost:3000,http://localhost:5173,http://localhost:8000,http://localhost:8080,http://localhost:32100",
 )
 
-# Build a de-duplicated list of allowed origins
-ALLOWED_ORIGINS: List[str] = []
-for part in (FRONTEND_ORIGIN or "").split(","):
-    p = part.strip()
-    if p and p not in ALLOWED_ORIGINS:
-        ALLOWED_ORIGINS.append(p)
-
-# Ensure common fallbacks
-for fallback in [
+# Common fallbacks that are always allowed
+_FALLBACK_ORIGINS = (
     "http://localhost:3000",
     "http://localhost:5173",
     "http://localhost:8000",
     "http://localhost:8080",
     "http://localhost:32100",
-]:
-    if fallback not in ALLOWED_ORIGINS:
-        ALLOWED_ORIGINS.append(fallback)
+)
+
+# Build a de-duplicated list of allowed origins (order preserved for CORSMiddleware)
+_seen_origins = set()
+ALLOWED_ORIGINS: List[str] = []
+for part in chain((FRONTEND_ORIGIN or "").split(","), _FALLBACK_ORIGINS):
+    p = part.strip()
+    if p and p not in _seen_origins:
+        _seen_origins.add(p)
+        ALLOWED_ORIGINS.append(p)
+
+# O(1) membership for any runtime origin checks
+ALLOWED_ORIGINS_SET: FrozenSet[str] = frozenset(_seen_origins)
 
 logger.info("CORS allowed origins: %s", ALLOWED_ORIGINS)
 logger.info("Proxying requests to RELAY_UPSTREAM=%s", RELAY_UPSTREAM)
@@ -66,6 +71,10 @@ app.add_middleware(
 
 _memory = get_memory_manager()
 
+# Shared upstream HTTP client, created on startup so connections are kept alive
+# and reused across proxied requests instead of re-opened per call.
+_client: Optional[httpx.AsyncClient] = None
+
 # Utility: filter hop-by-hop headers that should not be forwarded back to client
 HOP_BY_HOP = {
     "connection",
@@ -78,6 +87,19 @@ HOP_BY_HOP = {
     "upgrade",
     "content-length",
 }
+_HOP_BY_HOP_BYTES = frozenset(h.encode("latin-1") for h in HOP_BY_HOP)
+
+# Incoming request headers forwarded upstream as (lookup name, outgoing name);
+# Content-Type matters for POST, the rest for CORS preflight
+_FORWARD_HEADERS = (
+    ("origin", "Origin"),
+    ("access-control-request-method", "Access-Control-Request-Method"),
+    ("access-control-request-headers", "Access-Control-Request-Headers"),
+    ("content-type", "Content-Type"),
+)
+
+# Static error frame sent to WS clients when the upstream cannot be reached
+_WS_UPSTREAM_FAILED = json.dumps({"type": "error", "error": "upstream_connection_failed"})
 
 
 def require_master(x_api_key: Optional[str]):
@@ -94,12 +116,22 @@ class ExecuteMethodRequest(BaseModel):
 
 @app.on_event("startup")
 async def on_startup():
+    global _client
     logger.info("Relay proxy starting up (port=%s)", RELAY_PORT)
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+        )
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
+    global _client
     logger.info("Relay proxy shutting down")
+    if _client is not None:
+        await _client.aclose()
+        _client = None
 
 
 # --- Proxy for /api/execute_method (OPTIONS + POST) ---
@@ -112,42 +144,47 @@ async def proxy_execute_method(request: Request, x_api_key: Optional[str] = Head
     upstream_url = RELAY_UPSTREAM.rstrip("/") + "/api/execute_method"
 
     # Build headers to forward — include common CORS preflight headers and the API key
-    incoming = {k.lower(): v for k, v in request.headers.items()}
+    # (request.headers is already case-insensitive, so look each one up directly)
     headers_to_send = {}
-    if "origin" in incoming:
-        headers_to_send["Origin"] = incoming["origin"]
-    if "access-control-request-method" in incoming:
-        headers_to_send["Access-Control-Request-Method"] = incoming["access-control-request-method"]
-    if "access-control-request-headers" in incoming:
-        headers_to_send["Access-Control-Request-Headers"] = incoming["access-control-request-headers"]
-    # Content-Type for POST
-    if incoming.get("content-type"):
-        headers_to_send["Content-Type"] = incoming["content-type"]
+    for src, dst in _FORWARD_HEADERS:
+        v = request.headers.get(src)
+        if v:
+            headers_to_send[dst] = v
     # Forward X-API-Key if present (explicitly)
     if x_api_key:
         headers_to_send["X-API-Key"] = x_api_key
 
     logger.debug("Proxying %s %s to upstream %s headers=%s", request.method, request.url.path, upstream_url, headers_to_send)
 
-    async with httpx.AsyncClient() as client:
-        if request.method == "OPTIONS":
-            try:
-                resp = await client.options(upstream_url, headers=headers_to_send, timeout=10.0)
-            except httpx.HTTPError as e:
-                logger.warning("Upstream OPTIONS failed: %s", e)
-                raise HTTPException(status_code=502, detail="Upstream OPTIONS failed")
-            # Forward relevant headers (filter hop-by-hop)
-            out_headers = {k: v for k, v in resp.headers.items() if k.lower() not in HOP_BY_HOP}
-            return Response(status_code=resp.status_code, headers=out_headers, content=resp.content)
-        else:
-            body = await request.body()
-            try:
-                resp = await client.post(upstream_url, headers=headers_to_send, content=body, timeout=30.0)
-            except httpx.HTTPError as e:
-                logger.warning("Upstream POST failed: %s", e)
-                raise HTTPException(status_code=502, detail="Upstream POST failed")
-            out_headers = {k: v for k, v in resp.headers.items() if k.lower() not in HOP_BY_HOP}
-            return Response(status_code=resp.status_code, headers=out_headers, content=resp.content)
+    if request.method == "OPTIONS":
+        upstream_req = _client.build_request("OPTIONS", upstream_url, headers=headers_to_send, timeout=10.0)
+    else:
+        body = await request.body()
+        upstream_req = _client.build_request(
+            "POST", upstream_url, headers=headers_to_send, content=body, timeout=30.0
+        )
+
+    try:
+        # Stream the upstream body through instead of buffering it; the upstream
+        # response is closed once the client has received the last chunk.
+        resp = await _client.send(upstream_req, stream=True)
+    except httpx.HTTPError as e:
+        logger.warning("Upstream %s failed: %s", request.method, e)
+        raise HTTPException(status_code=502, detail=f"Upstream {request.method} failed")
+
+    response = StreamingResponse(
+        resp.aiter_raw(),
+        status_code=resp.status_code,
+        background=BackgroundTask(resp.aclose),
+    )
+    # Forward relevant headers (filter hop-by-hop) as raw byte pairs: no str decoding,
+    # and repeated headers such as Set-Cookie are kept instead of collapsed.
+    # httpx keeps the upstream casing while ASGI expects lowercase names.
+    for key, value in resp.headers.raw:
+        key = key.lower()
+        if key not in _HOP_BY_HOP_BYTES:
+            response.raw_headers.append((key, value))
+    return response
 
 
 # --- Proxy for WebSocket /ws/ai-chat ---
@@ -158,8 +195,6 @@ async def proxy_ws(websocket: WebSocket):
     at RELAY_UPSTREAM/ws/ai-chat. Query params and X-API-Key are forwarded where appropriate.
     """
     await websocket.accept()
-    incoming_query = dict(websocket.query_params)
-    incoming_headers = {k.lower(): v for k, v in websocket.headers.items()}
 
     # Build upstream ws URL (ws:// or wss://)
     parsed = urlparse(RELAY_UPSTREAM)
@@ -167,14 +202,16 @@ async def proxy_ws(websocket: WebSocket):
     netloc = parsed.netloc
     upstream_path = "/ws/ai-chat"
 
-    # Merge query params: preserve incoming and attach api_key if header present
-    qparams = incoming_query.copy()
-    # Prefer explicit api_key param if provided by client, else use x-api-key header
-    if "api_key" not in qparams and "x-api-key" in incoming_headers:
-        qparams["api_key"] = incoming_headers["x-api-key"]
+    # Forward the raw query string untouched (keeps repeated keys) and attach api_key
+    # from the X-API-Key header unless the client already passed one explicitly.
+    query_string = websocket.scope.get("query_string", b"").decode("latin-1")
+    api_key = websocket.headers.get("x-api-key")
+    if api_key is not None and "api_key" not in websocket.query_params:
+        query_string += ("&" if query_string else "") + "api_key=" + quote_plus(api_key)
 
-    query_string = ("?" + urlencode(qparams)) if qparams else ""
-    upstream_ws_url = urlunparse((ws_scheme, netloc, upstream_path, "", urlencode(qparams), ""))
+    upstream_ws_url = f"{ws_scheme}://{netloc}{upstream_path}"
+    if query_string:
+        upstream_ws_url += "?" + query_string
 
     logger.info("Proxying WS client -> upstream: %s", upstream_ws_url)
 
@@ -187,71 +224,53 @@ async def proxy_ws(websocket: WebSocket):
                     async for message in upstream_ws:
                         # websockets lib yields str (text) or bytes
                         if isinstance(message, (bytes, bytearray)):
-                            try:
-                                await websocket.send_bytes(message)
-                            except Exception:
-                                # client likely disconnected
-                                await upstream_ws.close()
-                                break
+                            await websocket.send_bytes(message)
                         else:
-                            try:
-                                await websocket.send_text(message)
-                            except Exception:
-                                await upstream_ws.close()
-                                break
+                            await websocket.send_text(message)
                 except websockets.ConnectionClosed:
                     pass
                 except Exception as e:
-                    logger.debug("Error receiving from upstream WS: %s", e)
-                finally:
-                    # ensure client closed
-                    try:
-                        await websocket.close()
-                    except Exception:
-                        pass
+                    # client likely disconnected
+                    logger.debug("Error relaying from upstream WS: %s", e)
 
             async def from_client():
+                receive = websocket.receive
+                send = upstream_ws.send
                 try:
                     while True:
-                        data = await websocket.receive()
-                        t = data.get("type")
-                        if t == "websocket.disconnect":
+                        data = await receive()
+                        # A websocket.receive message carries "text" or "bytes";
+                        # websocket.disconnect carries neither.
+                        text = data.get("text")
+                        if text is not None:
+                            await send(text)
+                            continue
+                        payload = data.get("bytes")
+                        if payload is None:
                             # client requested disconnect
-                            try:
-                                await upstream_ws.close()
-                            except Exception:
-                                pass
                             break
-                        if "text" in data and data["text"] is not None:
-                            try:
-                                await upstream_ws.send(data["text"])
-                            except Exception:
-                                break
-                        elif "bytes" in data and data["bytes"] is not None:
-                            try:
-                                await upstream_ws.send(data["bytes"])
-                            except Exception:
-                                break
+                        await send(payload)
                 except WebSocketDisconnect:
-                    try:
-                        await upstream_ws.close()
-                    except Exception:
-                        pass
+                    pass
                 except Exception as e:
-                    logger.debug("Error receiving from client WS: %s", e)
-                    try:
-                        await upstream_ws.close()
-                    except Exception:
-                        pass
-
-            await asyncio.gather(from_upstream(), from_client())
+                    logger.debug("Error relaying from client WS: %s", e)
+
+            # Whichever direction ends first cancels its peer, so neither socket is held
+            # open waiting for the other side to drain. Leaving the `async with` closes
+            # the upstream; the `finally` below closes the client.
+            async with asyncio.TaskGroup() as tg:
+                upstream_task = tg.create_task(from_upstream())
+                client_task = tg.create_task(from_client())
+                upstream_task.add_done_callback(lambda _: client_task.cancel())
+                client_task.add_done_callback(lambda _: upstream_task.cancel())
     except Exception as e:
         logger.warning("Failed to connect to upstream WebSocket: %s", e)
         try:
             # Inform client of failure before closing
-            await websocket.send_text(json.dumps({"type": "error", "error": "upstream_connection_failed"}))
+            await websocket.send_text(_WS_UPSTREAM_FAILED)
         except Exception:
             pass
+    finally:
         try:
             await websocket.close()
         except Exception: